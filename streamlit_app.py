@@ -1,29 +1,42 @@
 # app.py — Ayla (Atendente de Imobiliária) no padrão "Streamlit AI assistant"
 # ---------------------------------------------------------------------------
-# Requisitos: streamlit, python-dotenv, pandas, openpyxl (para salvar .xlsx)
+# Requisitos: streamlit, python-dotenv, pandas, openpyxl (para exportar .xlsx)
 # pip install streamlit python-dotenv pandas openpyxl
 #
 # Variáveis de ambiente (.env):
-#   OPENAI_API_KEY=...         (opcional; não é usado neste fluxo, mas deixado pronto)
 #   COMPANY_NAME=Imobiliária XYZ
 #   COMPANY_BLURB=A melhor escolha para sua casa nova!
+#   ADMIN_TOKEN=...            (opcional; libera o download .xlsx em ?admin=<token>)
 # ---------------------------------------------------------------------------
 
 from dotenv import load_dotenv
-import os, re, time, datetime, textwrap
-from collections import namedtuple
+import csv, hmac, io, json, logging, os, time
+from types import SimpleNamespace
 
 import pandas as pd
 import streamlit as st
 
 # -----------------------------------------------------------------------------
 # Configuração básica (padrão do demo)
-st.set_page_config(page_title="Ayla • Assistente de Imobiliária", page_icon="✨")
+# (page config só no primeiro run da sessão; o navegador mantém título/ícone nos reruns)
+if "_page_config_done" not in st.session_state:
+    st.set_page_config(page_title="Ayla • Assistente de Imobiliária", page_icon="✨")
+    st.session_state._page_config_done = True
+
+@st.cache_resource(show_spinner=False)
+def _boot_config() -> SimpleNamespace:
+    """Lê o .env e as variáveis de ambiente uma única vez por processo."""
+    load_dotenv()
+    return SimpleNamespace(
+        company_name=os.getenv("COMPANY_NAME", "Imobiliária XYZ"),
+        company_blurb=os.getenv("COMPANY_BLURB", "A melhor escolha para sua casa nova!"),
+        admin_token=os.getenv("ADMIN_TOKEN", ""),
+    )
 
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")  # reservado p/ uso futuro
-COMPANY_NAME = os.getenv("COMPANY_NAME", "Imobiliária XYZ")
-COMPANY_BLURB = os.getenv("COMPANY_BLURB", "A melhor escolha para sua casa nova!")
+_cfg = _boot_config()
+COMPANY_NAME = _cfg.company_name
+COMPANY_BLURB = _cfg.company_blurb
+ADMIN_TOKEN = _cfg.admin_token
 
 WELCOME_MSG = (
     f"Oi! Sou a **Ayla**, da **{COMPANY_NAME}**. {COMPANY_BLURB}\n\n"
@@ -40,7 +53,7 @@ SUGGESTIONS = {
 }
 
 # Rate limit “mínimo” entre perguntas (seguindo o espírito do demo)
-MIN_TIME_BETWEEN_REQUESTS = datetime.timedelta(seconds=1)
+MIN_TIME_BETWEEN_REQUESTS = 1.0  # segundos
 
 # -----------------------------------------------------------------------------
 # Fluxo de perguntas do funil
@@ -55,28 +68,57 @@ PERGUNTAS = {
     "faixa_preco": "Qual a faixa de preço que você tem em mente? (responda livremente)",
     "urgencia": "Qual é a urgência da sua busca? (alta, média, baixa)",
 }
+PERGUNTA_KEYS = tuple(PERGUNTAS.keys())
+N_PERGUNTAS = len(PERGUNTA_KEYS)
+
+# Mensagens de erro “amigáveis” por campo
+MENSAGENS_ERRO = {
+    "nome": "Por favor, informe **nome e sobrenome**.",
+    "telefone": "Telefone deve ter **11 dígitos** (DDD + número), ex.: 11987654321.",
+    "email": "Digite um **e-mail válido**, ex.: nome@dominio.com.",
+    "operacao": "Responda com **1** (Compra) ou **2** (Aluguel).",
+    "tipo_imovel": "Escolha entre **casa**, **apartamento** ou **outro**.",
+    "metragem": "Digite **apenas números**, ex.: 80.",
+    "quartos": "Digite **apenas números**, ex.: 2.",
+    "urgencia": "Responda **alta**, **média** ou **baixa**.",
+}
 
 # Validadores
+# Respostas aceitas -> valor salvo (validação e normalização usam o mesmo mapa)
+_OPERACOES = {"1": "compra", "2": "aluguel"}
+_TIPOS = frozenset({"casa", "apartamento", "outro"})
+_URGENCIA_MAP = {"alta": "alta", "media": "media", "média": "media", "baixa": "baixa"}
+_CAMPOS_NUMERICOS = frozenset({"metragem", "quartos"})
+
 def validar_nome(nome: str) -> bool:
     return len(nome.split()) >= 2
 
 def validar_telefone(telefone: str) -> bool:
-    return bool(re.fullmatch(r"\d{11}", telefone))
+    t = telefone.strip()
+    return len(t) == 11 and t.isascii() and t.isdigit()
 
 def validar_email(email: str) -> bool:
-    return bool(re.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+", email))
+    # Mesmo critério de `[^@\s]+@[^@\s]+\.[^@\s]+`, sem regex
+    e = email.strip()
+    if any(c.isspace() for c in e):
+        return False
+    at = e.find("@")
+    if at <= 0 or at != e.rfind("@"):
+        return False
+    dot = e.find(".", at + 2)
+    return dot != -1 and dot < len(e) - 1
 
 def validar_operacao(op: str) -> bool:
-    return op.strip() in {"1", "2"}
+    return op.strip() in _OPERACOES
 
 def validar_tipo_imovel(tipo: str) -> bool:
-    return tipo.strip().lower() in {"casa", "apartamento", "outro"}
+    return tipo.strip().lower() in _TIPOS
 
 def validar_numero(valor: str) -> bool:
     return valor.strip().isdigit()
 
 def validar_urgencia(u: str) -> bool:
-    return u.strip().lower() in {"alta", "media", "média", "baixa"}
+    return u.strip().lower() in _URGENCIA_MAP
 
 VALIDADORES = {
     "nome": validar_nome,
@@ -94,30 +136,73 @@ VALIDADORES = {
 def normalizar_campo(chave: str, valor: str) -> str:
     v = valor.strip()
     if chave == "operacao":
-        return "compra" if v == "1" else "aluguel"
+        return _OPERACOES[v]
     if chave == "urgencia":
-        return "media" if v.lower() in {"media", "média"} else v.lower()
-    if chave in {"metragem", "quartos"}:
+        return _URGENCIA_MAP[v.lower()]
+    if chave in _CAMPOS_NUMERICOS:
         return str(int(v))  # remove zeros à esquerda
     return v
 
 # -----------------------------------------------------------------------------
 # Persistência do lead
-LEADS_PATH = "imobiliaria_leads.xlsx"
+LEADS_PATH = "imobiliaria_leads.csv"
+LEGACY_XLSX_PATH = "imobiliaria_leads.xlsx"  # formato antigo (antes da troca para CSV)
+HEADERS = PERGUNTA_KEYS  # ordem fixa das colunas do arquivo
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def _load_leads_df(path: str, mtime: float) -> pd.DataFrame:
+    # mtime entra na chave do cache: qualquer escrita no arquivo invalida a leitura antiga
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def carregar_leads(path: str = LEADS_PATH) -> pd.DataFrame:
+    """Lê os leads salvos (com cache entre reruns); vazio se ainda não há arquivo."""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=list(HEADERS))
+    return _load_leads_df(path, os.path.getmtime(path))
+
+def _log_path(path: str) -> str:
+    """Log append-only (1 lead JSON por linha) ao lado do CSV: leads.csv -> leads.jsonl."""
+    return os.path.splitext(path)[0] + ".jsonl"
+
+def _gravar_lead(lead: dict, path: str):
+    with open(_log_path(path), "a", encoding="utf-8") as f:
+        f.write(json.dumps(lead, ensure_ascii=False) + "\n")
+
+    # Append de uma única linha no CSV: não relê nem reescreve os leads anteriores
+    novo = not os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=HEADERS)
+        if novo:
+            w.writeheader()
+        w.writerow(lead)
 
 def salvar_lead(lead: dict, path: str = LEADS_PATH):
-    df = pd.DataFrame([lead])
-    if os.path.exists(path):
-        # Append preservando colunas existentes
-        try:
-            antigo = pd.read_excel(path)
-            combinado = pd.concat([antigo, df], ignore_index=True)
-            combinado.to_excel(path, index=False)
-        except Exception:
-            # Se planilha estiver corrompida ou sem colunas compatíveis, sobrescreve
-            df.to_excel(path, index=False)
-    else:
-        df.to_excel(path, index=False)
+    # Gravação síncrona: é um append de uma linha, e o lead só é dado como salvo depois dela
+    _gravar_lead(lead, path)
+
+@st.cache_resource(show_spinner=False)
+def _importar_xlsx_legado(xlsx_path: str = LEGACY_XLSX_PATH, path: str = LEADS_PATH) -> bool:
+    """Importa (uma vez por processo) a planilha .xlsx antiga para o CSV, se o CSV ainda não existe."""
+    if not os.path.exists(xlsx_path) or os.path.exists(path):
+        return False
+    try:
+        antigo = pd.read_excel(xlsx_path, dtype=str).fillna("")
+    except Exception:
+        # Planilha corrompida: não derruba o app, só registra
+        logging.getLogger(__name__).exception("Falha ao importar %s", xlsx_path)
+        return False
+    tmp = path + ".tmp"
+    antigo.reindex(columns=list(HEADERS), fill_value="").to_csv(tmp, index=False, encoding="utf-8")
+    os.replace(tmp, path)  # CSV aparece completo ou não aparece
+    return True
+
+_importar_xlsx_legado()
+
+def export_xlsx(path: str = LEADS_PATH) -> bytes:
+    """Gera uma planilha .xlsx com todos os leads, sob demanda (uso humano/admin)."""
+    buf = io.BytesIO()
+    carregar_leads(path).to_excel(buf, index=False)
+    return buf.getvalue()
 
 # -----------------------------------------------------------------------------
 # UI utilitários no padrão do demo
@@ -136,7 +221,27 @@ def clear_conversation():
     st.session_state.selected_suggestion = None
     st.session_state.lead = {}
     st.session_state.step = 0
-    st.session_state.prev_question_timestamp = datetime.datetime.fromtimestamp(0)
+    st.session_state.prev_question_timestamp = 0.0
+
+def say(role: str, content: str):
+    """Registra a mensagem no histórico e a exibe como bubble (markdown)."""
+    st.session_state.messages.append({"role": role, "content": content})
+    with st.chat_message(role):
+        st.markdown(content)
+
+def say_text(role: str, content: str):
+    """Como `say`, mas exibe texto puro (sem markdown) — para conteúdo do usuário."""
+    st.session_state.messages.append({"role": role, "content": content})
+    with st.chat_message(role):
+        st.text(content)
+
+def render_message(m: dict):
+    """Redesenha uma mensagem do histórico (usuário em texto puro, sem markdown/LaTeX)."""
+    with st.chat_message(m["role"]):
+        if m["role"] == "user":
+            st.text(m["content"])
+        else:
+            st.markdown(m["content"])
 
 # Inicialização do estado de sessão
 if "messages" not in st.session_state:
@@ -146,7 +251,7 @@ if "lead" not in st.session_state:
 if "step" not in st.session_state:
     st.session_state.step = 0
 if "prev_question_timestamp" not in st.session_state:
-    st.session_state.prev_question_timestamp = datetime.datetime.fromtimestamp(0)
+    st.session_state.prev_question_timestamp = 0.0
 
 # -----------------------------------------------------------------------------
 # Cabeçalho (padrão semelhante ao demo)
@@ -155,6 +260,19 @@ with title_row:
     st.title("Ayla • Assistente de Imobiliária", anchor=False, width="stretch")
     st.button("Restart", icon=":material/refresh:", on_click=clear_conversation)
 
+# Exportação .xlsx para a equipe (só com ?admin=<ADMIN_TOKEN>); planilha gerada sob demanda
+if ADMIN_TOKEN and hmac.compare_digest(
+    st.query_params.get("admin", "").encode(), ADMIN_TOKEN.encode()
+):
+    with st.sidebar:
+        if st.button("Gerar planilha de leads", icon=":material/table:"):
+            st.download_button(
+                "Baixar .xlsx",
+                data=export_xlsx(),
+                file_name="imobiliaria_leads.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
 # Tela inicial (sem histórico e sem pergunta ainda)
 user_just_asked_initial_question = (
     "initial_question" in st.session_state and st.session_state.initial_question
@@ -187,9 +305,8 @@ if not (user_just_asked_initial_question or user_just_clicked_suggestion) and no
 
 # -----------------------------------------------------------------------------
 # Exibir histórico como “bubbles”
-for i, m in enumerate(st.session_state.messages):
-    with st.chat_message(m["role"]):
-        st.markdown(m["content"])
+for m in st.session_state.messages:
+    render_message(m)
 
 # Entrada do usuário (inferior)
 user_message = st.chat_input("Digite sua resposta...")
@@ -205,50 +322,48 @@ if not user_message:
 # Lógica do fluxo do funil em cima do padrão de chat
 def perguntar_proximo_campo():
     """Mostra próxima pergunta do funil, no estilo de chat assistant."""
-    if st.session_state.step < len(PERGUNTAS):
-        chave = list(PERGUNTAS.keys())[st.session_state.step]
-        st.session_state.messages.append({"role": "assistant", "content": PERGUNTAS[chave]})
-        with st.chat_message("assistant"):
-            st.markdown(PERGUNTAS[chave])
+    if st.session_state.step < N_PERGUNTAS:
+        chave = PERGUNTA_KEYS[st.session_state.step]
+        say("assistant", PERGUNTAS[chave])
     else:
         # Finaliza cadastro
-        salvar_lead(st.session_state.lead)
+        try:
+            salvar_lead(st.session_state.lead)
+        except OSError:
+            logging.getLogger(__name__).exception("Falha ao salvar lead")
+            say("assistant", "⚠️ Não consegui salvar seus dados agora. Por favor, responda novamente.")
+            # Volta um passo: a nova resposta à última pergunta tenta salvar de novo
+            st.session_state.step -= 1
+            say("assistant", PERGUNTAS[PERGUNTA_KEYS[st.session_state.step]])
+            return
         msg_final = (
             "Perfeito! Lead completo e salvo ✅\n\n"
             "Em breve nossa equipe entrará em contato. "
             "Se quiser, pode me contar mais preferências (bairro, vagas, pet-friendly etc.)."
         )
-        st.session_state.messages.append({"role": "assistant", "content": msg_final})
-        with st.chat_message("assistant"):
-            st.markdown(msg_final)
+        say("assistant", msg_final)
 
-# Se não há mensagens ainda, solta a saudação + primeira pergunta
+# Se não há mensagens ainda, solta a saudação + primeira pergunta (num único bubble)
 if not has_message_history:
-    st.session_state.messages.append({"role": "assistant", "content": WELCOME_MSG})
-    with st.chat_message("assistant"):
-        st.markdown(WELCOME_MSG)
-    perguntar_proximo_campo()
+    say("assistant", f"{WELCOME_MSG}\n\n{PERGUNTAS[PERGUNTA_KEYS[0]]}")
 
-# Processa a mensagem do usuário (se houver)
+# Rate limit simples: mensagem rápida demais é descartada (sem bloquear o worker com sleep)
 if user_message:
-    # streamlit interpreta $ como LaTeX — escapamos
-    user_message = user_message.replace("$", r"\$")
-
-    # Rate limit simples
-    now = datetime.datetime.now()
-    delta = now - st.session_state.prev_question_timestamp
-    if delta < MIN_TIME_BETWEEN_REQUESTS:
-        time.sleep(max(0.0, MIN_TIME_BETWEEN_REQUESTS.total_seconds() - delta.total_seconds()))
-    st.session_state.prev_question_timestamp = datetime.datetime.now()
+    now = time.monotonic()
+    if now - st.session_state.prev_question_timestamp < MIN_TIME_BETWEEN_REQUESTS:
+        st.toast("⏳ Aguarde um instante e envie novamente...")
+        user_message = None
+    else:
+        st.session_state.prev_question_timestamp = now
 
+# Processa a mensagem do usuário (se houver)
+if user_message:
     # Exibe bubble do usuário
-    st.session_state.messages.append({"role": "user", "content": user_message})
-    with st.chat_message("user"):
-        st.text(user_message)
+    say_text("user", user_message)
 
     # Se ainda estamos no funil de coleta, validar e avançar
-    if st.session_state.step < len(PERGUNTAS):
-        chave = list(PERGUNTAS.keys())[st.session_state.step]
+    if st.session_state.step < N_PERGUNTAS:
+        chave = PERGUNTA_KEYS[st.session_state.step]
 
         # Validação
         if chave == "faixa_preco":  # campo livre sempre válido
@@ -263,31 +378,15 @@ if user_message:
             st.session_state.step += 1
 
             # Feedback curto e segue pergunta
-            with st.chat_message("assistant"):
-                st.markdown(":white_check_mark: Entendi!")
-            st.session_state.messages.append({"role": "assistant", "content": ":white_check_mark: Entendi!"})
+            say("assistant", ":white_check_mark: Entendi!")
 
             perguntar_proximo_campo()
         else:
             # Mensagem de erro “amigável”
-            mensagens_erro = {
-                "nome": "Por favor, informe **nome e sobrenome**.",
-                "telefone": "Telefone deve ter **11 dígitos** (DDD + número), ex.: 11987654321.",
-                "email": "Digite um **e-mail válido**, ex.: nome@dominio.com.",
-                "operacao": "Responda com **1** (Compra) ou **2** (Aluguel).",
-                "tipo_imovel": "Escolha entre **casa**, **apartamento** ou **outro**.",
-                "metragem": "Digite **apenas números**, ex.: 80.",
-                "quartos": "Digite **apenas números**, ex.: 2.",
-                "urgencia": "Responda **alta**, **média** ou **baixa**.",
-            }
-            erro = mensagens_erro.get(chave, "A resposta não é válida. Tente novamente.")
-            with st.chat_message("assistant"):
-                st.markdown(f"⚠️ {erro}")
-            st.session_state.messages.append({"role": "assistant", "content": f"⚠️ {erro}"})
+            erro = MENSAGENS_ERRO.get(chave, "A resposta não é válida. Tente novamente.")
+            say("assistant", f"⚠️ {erro}")
             # Repergunta o mesmo campo
-            with st.chat_message("assistant"):
-                st.markdown(PERGUNTAS[chave])
-            st.session_state.messages.append({"role": "assistant", "content": PERGUNTAS[chave]})
+            say("assistant", PERGUNTAS[chave])
 
     else:
         # Após finalizar o funil, trate mensagens como “pós-venda” (eco simples / FAQ placeholder)
@@ -295,9 +394,7 @@ if user_message:
             "Obrigada! Se quiser, posso anotar mais preferências (bairro, vagas, pet-friendly, "
             "condomínio, lazer). Também posso encaminhar seu contato para um corretor agora."
         )
-        with st.chat_message("assistant"):
-            st.markdown(resposta)
-        st.session_state.messages.append({"role": "assistant", "content": resposta})
+        say("assistant", resposta)
 
 # Rodapé pequeno (como no demo há links/avisos)
 st.caption(f"💼 {COMPANY_NAME} • {COMPANY_BLURB} • 📄 Leads em: `{LEADS_PATH}`")